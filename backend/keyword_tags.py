@@ -0,0 +1,207 @@
+import math
+import re
+
+from sqlalchemy import func, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from models import Movie, Tag, MovieTag, TagIndexStats
+
+# Movie keywords arrive as one free-text string per movie. They are split into
+# tags and stored in tags/movie_tags (an inverted index with a document
+# frequency per tag) so recommendation routes can match the user's note against
+# keywords without sending every movie to the LLM. Tags keep their phrase for
+# display and are matched on a normalized key (see normalize_tag).
+
+MAX_TAG_WORDS = 4     # Longer segments are treated as prose and split into words
+MAX_NOTE_NGRAM = 3    # Longest tag phrase looked for in a user's note
+TAG_INDEX_STATS_ID = 1
+
+_SEGMENT_SPLIT_RE = re.compile(r"[,;|/\n·•]+")
+_WORD_RE = re.compile(r"[a-z0-9]+(?:'[a-z0-9]+)*")
+
+STOPWORDS = frozenset("""
+a an and are as at be been but by for from had has have he her his i i'm im in is it
+its me my of on or our she so that the their them they this to was we were what when
+who will with you your just feel feeling like really very about into out up not no
+""".split())
+
+
+def _words(text):
+    return _WORD_RE.findall((text or "").lower())
+
+
+def _singular(word):
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "is", "us")):
+        return word[:-1]
+    return word
+
+
+# Matching key: "Road Trips" and "road trip" share the key "road trip"
+def normalize_tag(raw_tag):
+    return " ".join(_singular(w) for w in _words(raw_tag))[:255]
+
+
+# "Grief, found family;  Road Trips" -> ["grief", "found family", "road trips"],
+# one phrase per matching key
+def parse_keyword_tags(keyword_text):
+    tags = {}
+    for segment in _SEGMENT_SPLIT_RE.split(keyword_text or ""):
+        words = _words(segment)
+        if len(words) > MAX_TAG_WORDS:
+            candidates = [w for w in words if w not in STOPWORDS]
+        else:
+            candidates = [" ".join(words)]
+        for candidate in candidates:
+            key = normalize_tag(candidate)
+            if key and key not in STOPWORDS and key not in tags:
+                tags[key] = candidate[:255]
+    return list(tags.values())
+
+
+# Every 1..MAX_NOTE_NGRAM word phrase in the note that could be a tag name
+def note_tag_candidates(note):
+    words = [_singular(w) for w in _words(note)]
+    candidates = set()
+    for n in range(1, MAX_NOTE_NGRAM + 1):
+        for i in range(len(words) - n + 1):
+            phrase = words[i:i + n]
+            if n == 1 and phrase[0] in STOPWORDS:
+                continue
+            candidates.add(" ".join(phrase))
+    return candidates
+
+
+# Upserts the movie's tags and links them to the movie. document_frequency is
+# bumped only for links that did not exist yet, and the tagged-movie counter
+# only when the movie had no tags before, so re-indexing a movie leaves the idf
+# inputs unchanged. Runs inside the caller's transaction.
+async def index_movie_tags(db: AsyncSession, movie_id, keyword_text):
+    tags = parse_keyword_tags(keyword_text)
+    if not tags:
+        return []
+
+    # The no-op update makes RETURNING include tags that already existed
+    tag_upsert = insert(Tag).values([{"key": normalize_tag(tag), "name": tag, "document_frequency": 0} for tag in tags])
+    tag_upsert = tag_upsert.on_conflict_do_update(
+        index_elements=[Tag.key],
+        set_={"document_frequency": Tag.document_frequency},
+    ).returning(Tag.id)
+    tag_ids = (await db.execute(tag_upsert)).scalars().all()
+
+    was_tagged = await db.scalar(select(MovieTag.tag_id).where(MovieTag.movie_id == movie_id).limit(1))
+    linked_tag_ids = (await db.execute(
+        insert(MovieTag)
+        .values([{"movie_id": movie_id, "tag_id": tag_id} for tag_id in tag_ids])
+        .on_conflict_do_nothing()
+        .returning(MovieTag.tag_id)
+    )).scalars().all()
+    if not linked_tag_ids:
+        return tags
+
+    await db.execute(
+        update(Tag)
+        .where(Tag.id.in_(linked_tag_ids))
+        .values(document_frequency=Tag.document_frequency + 1)
+    )
+    if was_tagged is None:
+        stats_upsert = insert(TagIndexStats).values(id=TAG_INDEX_STATS_ID, movie_count=1)
+        await db.execute(stats_upsert.on_conflict_do_update(
+            index_elements=[TagIndexStats.id],
+            set_={"movie_count": TagIndexStats.movie_count + 1},
+        ))
+    return tags
+
+
+# Startup helper: indexes movies whose keywords were stored before the tag
+# tables existed, and seeds the tagged-movie counter for indexes built before
+# it existed
+async def backfill_movie_tags(db: AsyncSession):
+    if await db.get(TagIndexStats, TAG_INDEX_STATS_ID) is None:
+        tagged = await db.scalar(select(func.count(func.distinct(MovieTag.movie_id))))
+        db.add(TagIndexStats(id=TAG_INDEX_STATS_ID, movie_count=tagged or 0))
+        await db.flush()
+
+    indexed = select(MovieTag.movie_id).distinct()
+    result = await db.execute(
+        select(Movie.id, Movie.keyword)
+        .where(Movie.keyword.isnot(None))
+        .where(Movie.id.not_in(indexed))
+    )
+    rows = result.all()
+    for movie_id, keyword_text in rows:
+        await index_movie_tags(db, movie_id, keyword_text)
+    await db.commit()
+    return len(rows)
+
+
+# Scores each candidate movie by the tags it shares with the user's note,
+# weighting rare tags higher (idf). Movies without overlap are left out.
+# Returns {movie_id: {"tag_score": float, "matched_tags": [...]}}
+async def score_note_tag_overlap(db: AsyncSession, note, movie_ids):
+    movie_ids = list(movie_ids)
+    candidates = note_tag_candidates(note)
+    if not candidates or not movie_ids:
+        return {}
+
+    tag_rows = (await db.execute(
+        select(Tag.id, Tag.name, Tag.document_frequency).where(Tag.key.in_(candidates))
+    )).all()
+    if not tag_rows:
+        return {}
+
+    total_movies = await db.scalar(
+        select(TagIndexStats.movie_count).where(TagIndexStats.id == TAG_INDEX_STATS_ID)
+    ) or 1
+    tag_info = {
+        tag_id: (name, math.log((total_movies + 1) / (df + 1)) + 1.0)
+        for tag_id, name, df in tag_rows
+    }
+
+    link_rows = (await db.execute(
+        select(MovieTag.movie_id, MovieTag.tag_id)
+        .where(MovieTag.tag_id.in_(tag_info.keys()))
+        .where(MovieTag.movie_id.in_(movie_ids))
+    )).all()
+
+    overlap = {}
+    for movie_id, tag_id in link_rows:
+        name, idf = tag_info[tag_id]
+        entry = overlap.setdefault(movie_id, {"tag_score": 0.0, "matched_tags": []})
+        entry["tag_score"] += idf
+        entry["matched_tags"].append(name)
+
+    for entry in overlap.values():
+        entry["tag_score"] = round(entry["tag_score"], 2)
+    return overlap
+
+
+# Copies tag overlap onto formatted movie dicts (tag_score 0 when none)
+def apply_tag_overlap(movies, overlap):
+    for m in movies:
+        entry = overlap.get(m["id"])
+        m["tag_score"] = entry["tag_score"] if entry else 0.0
+        m["matched_tags"] = entry["matched_tags"] if entry else []
+
+
+# Shortlist for the LLM: keyword matches first (strongest overlap, then mood
+# score), topped up with the best mood matches, capped at `limit`
+def shortlist_for_ai(movies, limit):
+    ranked = sorted(
+        movies,
+        key=lambda m: (m.get("tag_score", 0), m["match_score"]),
+        reverse=True,
+    )
+    return ranked[:limit]
+
+
+# Fast tier used when the LLM picked nothing (skipped, failed or "none"):
+# movies sharing tags with the note lead, ordered by overlap
+def keyword_match_tier(movies):
+    keyword_matches = [m for m in movies if m.get("tag_score", 0) > 0]
+    keyword_matches.sort(key=lambda m: (m["tag_score"], m["match_score"]), reverse=True)
+    for m in keyword_matches:
+        m["keyword_match"] = True
+    rest = [m for m in movies if m.get("tag_score", 0) <= 0]
+    return keyword_matches, rest
@@ -0,0 +1,325 @@
+import asyncio
+import contextvars
+import json
+import os
+import random
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+
+from request_profiler import record_llm_call
+from traffic_capture import current_replay_id, load_captured_llm_calls, prompt_hash, record_llm_exchange
+
+# Shared entry point for the AI rerank stage. Every recommendation route sends
+# its prompt through llm_router instead of talking to Gemini or Groq directly.
+#
+# - Providers are tried in a weighted-random order (LLM_PROVIDER_WEIGHTS,
+#   e.g. "groq=3,gemini=1"); a provider without an API key is skipped.
+# - Hedging: if the first provider has not produced a valid answer within its
+#   own recent p90 latency, the next one is started too and whichever returns
+#   a valid response first wins. A provider that errors hands off immediately.
+# - Both providers are asked for the same JSON shape and the result is
+#   normalized to a list of {"title", "reason"} dicts.
+# - Replay: with LLM_REPLAY_DIR set, the only provider answers from captured
+#   traffic (see traffic_capture.py / replay_traffic.py) instead of the network.
+
+DEFAULT_HEDGE_DELAY_SECONDS = 2.5
+MIN_HEDGE_DELAY_SECONDS = 0.2
+LATENCY_WINDOW = 100
+MIN_LATENCY_SAMPLES = 5
+
+RECOMMENDATIONS_JSON_FORMAT = """{
+  "recommendations": [
+    {
+      "title": "Exact Movie Title",
+      "reason": "One short sentence explaining why it fits."
+    }
+  ]
+}"""
+
+
+# Set by callers that run the router outside the requesting context (rerank
+# batches run in a fresh one). Every provider call, including failed and
+# hedge-lost ones, is appended so the caller can report it to each request.
+call_log = contextvars.ContextVar("llm_call_log", default=None)
+
+
+class LLMRouterError(Exception):
+    pass
+
+
+class LLMProvider(ABC):
+    name = None
+    model = None
+
+    def __init__(self, weight=1.0):
+        self.weight = weight
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def record_latency(self, seconds):
+        self.latencies.append(seconds)
+
+    # Cancelled (lost hedge) and failed calls only tell us the real latency was
+    # at least `seconds`. They are recorded only when that already exceeds the
+    # p90, so a slowing provider's estimate rises. Hedges cut short and fast
+    # failures (auth, rate limit, bad JSON) never pull it down.
+    def record_latency_lower_bound(self, seconds):
+        if seconds > self.p90_latency():
+            self.latencies.append(seconds)
+
+    def p90_latency(self):
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return DEFAULT_HEDGE_DELAY_SECONDS
+        ordered = sorted(self.latencies)
+        return max(ordered[int(0.9 * (len(ordered) - 1))], MIN_HEDGE_DELAY_SECONDS)
+
+    @abstractmethod
+    async def complete(self, system_prompt, user_prompt, temperature):
+        ...
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+    model = "gemini-2.0-flash"
+
+    def __init__(self, api_key, weight=1.0):
+        super().__init__(weight)
+        from google import genai
+        from google.genai import types
+
+        self._types = types
+        self.client = genai.Client(api_key=api_key)
+
+    async def complete(self, system_prompt, user_prompt, temperature):
+        response = await self.client.aio.models.generate_content(
+            model=self.model,
+            contents=user_prompt,
+            config=self._types.GenerateContentConfig(
+                system_instruction=system_prompt,
+                temperature=temperature,
+                response_mime_type="application/json",
+            ),
+        )
+        return response.text
+
+
+class GroqProvider(LLMProvider):
+    name = "groq"
+    model = "llama-3.3-70b-versatile"
+
+    def __init__(self, api_key, weight=1.0):
+        super().__init__(weight)
+        from groq import AsyncGroq
+
+        self.client = AsyncGroq(api_key=api_key)
+
+    async def complete(self, system_prompt, user_prompt, temperature):
+        chat_completion = await self.client.chat.completions.create(
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            model=self.model,
+            temperature=temperature,
+            response_format={"type": "json_object"},
+        )
+        return chat_completion.choices[0].message.content
+
+
+class ReplayProvider(LLMProvider):
+    name = "replay"
+
+    def __init__(self, capture_dir, simulate_latency=True):
+        super().__init__()
+        self.captured_calls = load_captured_llm_calls(capture_dir)
+        self.simulate_latency = simulate_latency
+
+    # Prefers the captured call with the same prompt; if this build's prompt
+    # differs, falls back to the request's first captured answer
+    async def complete(self, system_prompt, user_prompt, temperature):
+        calls = self.captured_calls.get(current_replay_id.get())
+        if not calls:
+            raise LookupError("No captured LLM response for this request")
+
+        wanted = prompt_hash(system_prompt, user_prompt)
+        call = next((c for c in calls if c["prompt_hash"] == wanted), calls[0])
+        if self.simulate_latency:
+            await asyncio.sleep(call["latency_ms"] / 1000)
+        return call["raw_response"]
+
+
+# Accepts {"recommendations": [...]}, {"movies": [...]}, any dict holding a
+# list, or a bare list. Raises ValueError if the shape is wrong so the router
+# can fall through to another provider.
+def parse_recommendations(raw_response):
+    if not raw_response:
+        raise ValueError("Empty LLM response")
+
+    parsed_json = json.loads(raw_response)
+    if isinstance(parsed_json, list):
+        items = parsed_json
+    elif isinstance(parsed_json, dict):
+        items = parsed_json.get("recommendations", parsed_json.get("movies"))
+        if items is None:
+            items = next((v for v in parsed_json.values() if isinstance(v, list)), None)
+    else:
+        items = None
+
+    if not isinstance(items, list):
+        raise ValueError("LLM response has no recommendation list")
+
+    recommendations = []
+    for item in items:
+        if isinstance(item, str):
+            item = {"title": item}
+        if not isinstance(item, dict) or not isinstance(item.get("title"), str):
+            raise ValueError(f"Malformed recommendation entry: {item!r}")
+        recommendations.append({
+            "title": item["title"].strip(),
+            "reason": str(item.get("reason") or "").strip(),
+        })
+    return recommendations
+
+
+class LLMResult:
+    __slots__ = ("provider", "recommendations", "latency", "batch_size")
+
+    def __init__(self, provider, recommendations, latency, batch_size=1):
+        self.provider = provider
+        self.recommendations = recommendations
+        self.latency = latency
+        self.batch_size = batch_size
+
+
+class LLMRouter:
+    def __init__(self, providers):
+        self.providers = [p for p in providers if p.weight > 0]
+
+    def _provider_order(self):
+        # Weighted shuffle: higher weight means more likely to go first
+        remaining = list(self.providers)
+        order = []
+        while remaining:
+            chosen = random.choices(remaining, weights=[p.weight for p in remaining])[0]
+            remaining.remove(chosen)
+            order.append(chosen)
+        return order
+
+    async def _call(self, provider, system_prompt, user_prompt, temperature, parse):
+        started = time.perf_counter()
+        raw_response = None
+        try:
+            raw_response = await provider.complete(system_prompt, user_prompt, temperature)
+            recommendations = parse(raw_response)
+        except asyncio.CancelledError:
+            latency = time.perf_counter() - started
+            provider.record_latency_lower_bound(latency)
+            self._report(provider, system_prompt, user_prompt, None, latency, False, "cancelled (hedge lost)")
+            raise
+        except Exception as e:
+            latency = time.perf_counter() - started
+            provider.record_latency_lower_bound(latency)
+            self._report(provider, system_prompt, user_prompt, raw_response, latency, False, str(e))
+            raise
+        latency = time.perf_counter() - started
+        provider.record_latency(latency)
+        self._report(provider, system_prompt, user_prompt, raw_response, latency, True)
+        return LLMResult(provider.name, recommendations, latency)
+
+    def _report(self, provider, system_prompt, user_prompt, raw_response, latency, ok, error=None):
+        cancelled = error == "cancelled (hedge lost)"
+        record_llm_call(provider.name, latency, ok, error)
+        if not cancelled:
+            record_llm_exchange(provider.name, system_prompt, user_prompt, raw_response, latency, ok)
+
+        log = call_log.get()
+        if log is not None:
+            log.append({
+                "provider": provider.name,
+                "system_prompt": system_prompt,
+                "user_prompt": user_prompt,
+                "raw_response": raw_response,
+                "latency": latency,
+                "ok": ok,
+                "error": error,
+                "cancelled": cancelled,
+            })
+
+    # `parse` validates the raw text and shapes the result; a response it
+    # rejects counts as a provider failure
+    async def rerank(self, system_prompt, user_prompt, temperature=0.3, parse=parse_recommendations):
+        waiting = self._provider_order()
+        if not waiting:
+            raise LLMRouterError("No LLM provider is configured")
+
+        running = {}
+        errors = []
+
+        def launch_next():
+            provider = waiting.pop(0)
+            task = asyncio.create_task(self._call(provider, system_prompt, user_prompt, temperature, parse))
+            running[task] = provider
+            return time.perf_counter() + provider.p90_latency()
+
+        hedge_at = launch_next()
+        try:
+            while running:
+                timeout = max(0.0, hedge_at - time.perf_counter()) if waiting else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # Slower than this provider's p90, hedge with the next one
+                    hedge_at = launch_next()
+                    continue
+
+                for task in done:
+                    provider = running.pop(task)
+                    try:
+                        return task.result()
+                    except Exception as e:
+                        print(f"LLM provider {provider.name} failed: {e}")
+                        errors.append(f"{provider.name}: {e}")
+
+                # Everything in flight failed, move on without waiting
+                if not running and waiting:
+                    hedge_at = launch_next()
+        finally:
+            for task in running:
+                task.cancel()
+            # Let hedges that lost finish cancelling so their calls are reported
+            # before the caller's profile/capture is closed
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+        raise LLMRouterError("All LLM providers failed: " + "; ".join(errors))
+
+
+def _parse_weights(raw):
+    weights = {}
+    for part in (raw or "").split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip():
+            weights[name.strip().lower()] = float(value)
+    return weights
+
+
+def build_router():
+    replay_dir = os.getenv("LLM_REPLAY_DIR")
+    if replay_dir:
+        simulate_latency = os.getenv("LLM_REPLAY_LATENCY", "1") != "0"
+        return LLMRouter([ReplayProvider(replay_dir, simulate_latency)])
+
+    weights = _parse_weights(os.getenv("LLM_PROVIDER_WEIGHTS"))
+    providers = []
+    for provider_cls, env_key in ((GroqProvider, "GROQ_API_KEY"), (GeminiProvider, "GEMINI_API_KEY")):
+        api_key = os.getenv(env_key)
+        if not api_key:
+            continue
+        try:
+            providers.append(provider_cls(api_key, weight=weights.get(provider_cls.name, 1.0)))
+        except ImportError as e:
+            print(f"LLM provider {provider_cls.name} unavailable: {e}")
+    return LLMRouter(providers)
+
+
+llm_router = build_router()
@@ -3,12 +3,17 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from database import AsyncSessionLocal
+from database import AsyncSessionLocal, engine
 from models import init_db  # Table creation helper, called from main.py on startup
+from keyword_tags import backfill_movie_tags
+from request_profiler import ProfilingMiddleware, install_sql_hooks
+from traffic_capture import TrafficCaptureMiddleware, install_capture_sql_hooks
 from routes.initialize_moods import initialize_moods
 from routes.add_movie_to_database import router as add_movie_router
 from routes.search_movie_in_database import router as search_movies_router
 from routes.generate_movie_recommendation import router as recommend_movies_router
+from routes.movie_reviews import router as movie_reviews_router
+from routes.admin_profiles import router as admin_profiles_router
 
 # Runs before the app starts accepting requests 
 @asynccontextmanager
@@ -16,6 +21,7 @@ async def lifespan(app: FastAPI):
     await init_db()
     async with AsyncSessionLocal() as session:
         await initialize_moods(session)
+        await backfill_movie_tags(session)
     print("-----> Database initialized!")
     yield  
 
@@ -33,10 +39,21 @@ app.add_middleware(
 )
 
 
+# Opt-in request profiling (see request_profiler.py), idle unless triggered
+app.add_middleware(ProfilingMiddleware)
+install_sql_hooks(engine)
+
+# Opt-in traffic capture for replay (see traffic_capture.py / replay_traffic.py)
+app.add_middleware(TrafficCaptureMiddleware)
+install_capture_sql_hooks(engine)
+
+
 # Routes 
 app.include_router(add_movie_router)
 app.include_router(search_movies_router)
 app.include_router(recommend_movies_router)
+app.include_router(movie_reviews_router)
+app.include_router(admin_profiles_router)
 
 
 
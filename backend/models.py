@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, Text, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, Float, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 
 from database import Base, engine # Source of base and engine
@@ -16,9 +16,11 @@ class Movie(Base):
     year = Column(Integer, nullable=False)
     synopsis = Column(Text, nullable=False)
     storyline = Column(Text, nullable=False)
+    keyword = Column(Text)  # Free-text keywords, parsed into tags/movie_tags on insert
     created_at = Column(DateTime, default=datetime.utcnow)
 
     moods = relationship("Mood", secondary="movie_moods", back_populates="movies")
+    reviews = relationship("Review", back_populates="movie", passive_deletes=True)
 
 
 class Mood(Base):
@@ -38,6 +40,63 @@ class MovieMood(Base):
     score = Column(Float)
 
 
+class Review(Base):
+    __tablename__ = "reviews"
+
+    id = Column(Integer, primary_key=True)
+    movie_id = Column(Integer, ForeignKey("movies.id", ondelete="CASCADE"), nullable=False)
+    review = Column(Text, nullable=False)
+    rating = Column(Integer, nullable=True)  # Optional 1-5 stars
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    movie = relationship("Movie", back_populates="reviews")
+
+    # Keyset pagination walks a movie's reviews newest-first by id
+    __table_args__ = (Index("ix_reviews_movie_id_id", "movie_id", "id"),)
+
+
+# Denormalized per-movie review summary, kept up to date on every review insert
+# so reads never need COUNT/AVG over the reviews table
+class MovieReviewStats(Base):
+    __tablename__ = "movie_review_stats"
+
+    movie_id = Column(Integer, ForeignKey("movies.id", ondelete="CASCADE"), primary_key=True)
+    review_count = Column(Integer, nullable=False, default=0)
+    rating_count = Column(Integer, nullable=False, default=0)
+    rating_sum = Column(Integer, nullable=False, default=0)
+    last_review_at = Column(DateTime)
+
+
+# Keyword tags; name is the phrase as first seen, key its normalized form used
+# for matching. document_frequency counts the movies carrying the tag
+class Tag(Base):
+    __tablename__ = "tags"
+
+    id = Column(Integer, primary_key=True)
+    key = Column(String(255), unique=True, nullable=False)
+    name = Column(String(255), nullable=False)
+    document_frequency = Column(Integer, nullable=False, default=0)
+
+
+# Single-row counter of tagged movies (id is always TAG_INDEX_STATS_ID), the
+# idf denominator; bumped by index_movie_tags so reads never COUNT movies
+class TagIndexStats(Base):
+    __tablename__ = "tag_index_stats"
+
+    id = Column(Integer, primary_key=True)
+    movie_count = Column(Integer, nullable=False, default=0)
+
+
+class MovieTag(Base):
+    __tablename__ = "movie_tags"
+
+    movie_id = Column(Integer, ForeignKey("movies.id", ondelete="CASCADE"), primary_key=True)
+    tag_id = Column(Integer, ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True)
+
+    # Inverted index: tag -> movies
+    __table_args__ = (Index("ix_movie_tags_tag_id_movie_id", "tag_id", "movie_id"),)
+
+
 # Table creation helper, called from main.py on startup
 async def init_db():
     async with engine.begin() as conn:
@@ -0,0 +1,63 @@
+from collections import namedtuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from models import Movie, Mood, MovieMood
+
+# Hot read paths select plain columns instead of Movie entities: no identity
+# map, no relationship loading, and each row maps straight into a compact
+# namedtuple. MovieRecord/SearchMovieRecord fields match the column lists
+# below, in order, so a result row can be sliced into a record directly.
+
+MOVIE_COLUMNS = (
+    Movie.id,
+    Movie.title,
+    Movie.year,
+    Movie.image_url,
+    Movie.synopsis,
+    Movie.keyword,
+)
+MovieRecord = namedtuple("MovieRecord", [c.key for c in MOVIE_COLUMNS])
+
+SEARCH_MOVIE_COLUMNS = (
+    Movie.id,
+    Movie.title,
+    Movie.year,
+    Movie.synopsis,
+    Movie.storyline,
+    Movie.image_url,
+    Movie.created_at,
+)
+SearchMovieRecord = namedtuple("SearchMovieRecord", [c.key for c in SEARCH_MOVIE_COLUMNS])
+
+
+# Builds a record from the leading MovieRecord columns of a result row
+def movie_record(row):
+    return MovieRecord._make(row[:len(MOVIE_COLUMNS)])
+
+
+# {movie_id: [(mood_name, score), ...]} for the given movies, in one query
+async def fetch_movie_moods(db: AsyncSession, movie_ids):
+    movie_ids = list(movie_ids)
+    if not movie_ids:
+        return {}
+
+    result = await db.execute(
+        select(MovieMood.movie_id, Mood.mood_name, MovieMood.score)
+        .join(Mood, MovieMood.mood_id == Mood.id)
+        .where(MovieMood.movie_id.in_(movie_ids))
+    )
+    movie_moods = {}
+    for movie_id, mood_name, score in result.all():
+        movie_moods.setdefault(movie_id, []).append((mood_name, score))
+    return movie_moods
+
+
+# Shared response shape for movie records: the record's columns, the movie's
+# mood names, then any route-specific fields
+def format_movie(record, mood_names, **extra):
+    movie = record._asdict()
+    movie["moods"] = mood_names
+    movie.update(extra)
+    return movie
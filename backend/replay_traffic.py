@@ -0,0 +1,166 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import time
+import uuid
+
+import httpx
+
+# Replays captured traffic (see traffic_capture.py) against a running build and
+# reports latency distributions and ranking differences.
+#
+# Start the target with LLM_REPLAY_DIR pointing at the same capture directory
+# so its LLM calls are answered from the captured responses, then run e.g.
+#   python replay_traffic.py captures --target http://localhost:8000 --rate 2
+# --rate scales the original pacing (2 = twice as fast, 0 = back to back).
+#
+# Session tokens are suffixed with a per-run id, so a run does not inherit the
+# seen-movie state (seen_movies.py) left behind by an earlier run. Requests from
+# one captured session still share a session within the run. The store lives
+# in the target's process, so start the target fresh before a replay to compare
+# builds on equal footing.
+
+RANKING_DEPTH = 10
+
+
+def load_captures(directory):
+    records = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.jsonl"))):
+        with open(path) as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    records.sort(key=lambda r: r["t"])
+    return records
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def compare_rankings(captured_ids, replayed_ids, depth=RANKING_DEPTH):
+    captured_top = captured_ids[:depth]
+    replayed_top = replayed_ids[:depth]
+    union = set(captured_top) | set(replayed_top)
+    overlap = len(set(captured_top) & set(replayed_top)) / len(union) if union else 1.0
+    first_diff = next(
+        (i for i, (a, b) in enumerate(zip(captured_ids, replayed_ids)) if a != b),
+        None if len(captured_ids) == len(replayed_ids) else min(len(captured_ids), len(replayed_ids)),
+    )
+    return {
+        "identical": captured_ids == replayed_ids,
+        "top_overlap": round(overlap, 3),
+        "first_difference_at": first_diff,
+    }
+
+
+def _response_ids(response):
+    try:
+        body = response.json()
+    except ValueError:
+        return []
+    movies = body.get("movies", []) if isinstance(body, dict) else body
+    return [m.get("id") for m in movies if isinstance(m, dict)] if isinstance(movies, list) else []
+
+
+# Captured session hash + run id: same session within a run, fresh per run
+def _replay_body(body, run_id):
+    if not isinstance(body, dict) or not body.get("sessionToken"):
+        return body
+    return {**body, "sessionToken": f"{body['sessionToken']}-{run_id}"}
+
+
+async def replay_one(client, record, target, run_id):
+    started = time.perf_counter()
+    try:
+        response = await client.request(
+            record["method"],
+            f"{target}{record['path']}" + (f"?{record['query']}" if record.get("query") else ""),
+            json=_replay_body(record.get("body"), run_id) if record["method"] != "GET" else None,
+            headers={"X-Replay-Id": record["id"]},
+        )
+    except httpx.HTTPError as e:
+        return {"id": record["id"], "path": record["path"], "error": str(e)}
+
+    latency_ms = (time.perf_counter() - started) * 1000
+    result = {
+        "id": record["id"],
+        "path": record["path"],
+        "status": response.status_code,
+        "captured_status": record.get("status"),
+        "latency_ms": round(latency_ms, 3),
+        "captured_latency_ms": record.get("stages", {}).get("total_ms"),
+    }
+    if response.status_code == 200:
+        result["ranking"] = compare_rankings(record.get("response", {}).get("movie_ids", []), _response_ids(response))
+    return result
+
+
+async def replay(records, target, rate, timeout, concurrency):
+    limits = httpx.Limits(max_connections=concurrency)
+    run_id = uuid.uuid4().hex[:8]
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        t0 = records[0]["t"] if records else 0
+        started = time.perf_counter()
+        results = []
+        in_flight = []
+        for record in records:
+            if rate > 0:
+                delay = (record["t"] - t0) / rate - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                in_flight.append(asyncio.create_task(replay_one(client, record, target, run_id)))
+            else:
+                results.append(await replay_one(client, record, target, run_id))
+        results.extend(await asyncio.gather(*in_flight))
+        return results
+
+
+def summarize(results):
+    summary = {}
+    for path in sorted({r["path"] for r in results}):
+        rows = [r for r in results if r["path"] == path]
+        latencies = [r["latency_ms"] for r in rows if "latency_ms" in r]
+        captured = [r["captured_latency_ms"] for r in rows if r.get("captured_latency_ms") is not None]
+        rankings = [r["ranking"] for r in rows if "ranking" in r]
+        summary[path] = {
+            "requests": len(rows),
+            "errors": sum(1 for r in rows if "error" in r),
+            "status_changed": sum(1 for r in rows if "status" in r and r["status"] != r.get("captured_status")),
+            "latency_ms": {p: percentile(latencies, q) for p, q in (("p50", 50), ("p90", 90), ("p99", 99))},
+            "captured_latency_ms": {p: percentile(captured, q) for p, q in (("p50", 50), ("p90", 90), ("p99", 99))},
+            "identical_rankings": sum(1 for r in rankings if r["identical"]),
+            "compared_rankings": len(rankings),
+            "mean_top_overlap": round(sum(r["top_overlap"] for r in rankings) / len(rankings), 3) if rankings else None,
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured Movie Feels traffic against a target build.")
+    parser.add_argument("capture_dir", help="Directory of capture-*.jsonl files")
+    parser.add_argument("--target", default="http://localhost:8000", help="Base URL of the build under test")
+    parser.add_argument("--rate", type=float, default=1.0, help="Pacing multiplier, 0 replays back to back")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--concurrency", type=int, default=50, help="Max open connections")
+    parser.add_argument("--report", help="Write per-request results and the summary to this JSON file")
+    args = parser.parse_args()
+
+    records = load_captures(args.capture_dir)
+    if not records:
+        parser.error(f"No captured requests found in {args.capture_dir}")
+
+    results = asyncio.run(replay(records, args.target.rstrip("/"), args.rate, args.timeout, args.concurrency))
+    summary = summarize(results)
+    print(json.dumps(summary, indent=2))
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"summary": summary, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
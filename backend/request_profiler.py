@@ -0,0 +1,282 @@
+import asyncio
+import contextvars
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import event
+
+# Opt-in per-request profiling. A request is profiled when it carries
+# X-Profile-Request matching PROFILE_TOKEN, or when it falls inside
+# PROFILE_SAMPLE_RATE (0.0-1.0, default off). A profile holds:
+# - stack samples in folded format (one "frame;frame;frame count" line per
+#   stack), loadable by flamegraph.pl, speedscope or inferno. The event loop
+#   thread is shared by all requests, so a sample is kept only while the
+#   profiled request's own task is running; samples taken while other tasks
+#   run or the loop is idle only bump other_samples. Work the request hands to
+#   other tasks (hedged LLM calls, rerank batches) or to worker threads is not
+#   in the stacks; the SQL and LLM timings below still cover it.
+# - every SQL statement with its duration and row count, via engine events
+# - every LLM call with provider, duration and outcome, reported by llm_router
+# Finished profiles go to PROFILE_DIR as JSON, keeping the newest
+# PROFILE_MAX_FILES. When nothing is being profiled the hooks only do a
+# context variable lookup.
+
+PROFILE_HEADER = b"x-profile-request"
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0") or 0)
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+SAMPLE_INTERVAL_SECONDS = 0.005
+MAX_STACK_DEPTH = 128
+
+current_profile = contextvars.ContextVar("current_profile", default=None)
+
+
+class RequestProfile:
+    def __init__(self, method, path, thread_id, task, root_frame):
+        self.id = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+        self.method = method
+        self.path = path
+        self.thread_id = thread_id
+        self.task = task
+        self.loop = task.get_loop() if task is not None else None
+        self.root_frame = root_frame
+        self.started_at = datetime.utcnow()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.status_code = None
+        self.stacks = Counter()
+        self.other_samples = 0
+        self.sql = []
+        self.llm = []
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def folded(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status_code": self.status_code,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round((self.duration or 0) * 1000, 2),
+            "sample_interval_ms": SAMPLE_INTERVAL_SECONDS * 1000,
+            "sample_scope": "request task only",
+            "sample_count": sum(self.stacks.values()),
+            "other_samples": self.other_samples,
+            "sql_total_ms": round(sum(q["duration_ms"] for q in self.sql), 2),
+            "sql": self.sql,
+            "llm": self.llm,
+            "folded_stacks": self.folded(),
+        }
+
+
+class StackSampler:
+    # One background thread samples the stacks of every thread that has an
+    # active profile; it exits as soon as no profile is running.
+
+    def __init__(self, interval=SAMPLE_INTERVAL_SECONDS):
+        self.interval = interval
+        self._active = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, profile):
+        with self._lock:
+            self._active.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+
+    def stop(self, profile):
+        with self._lock:
+            self._active.discard(profile)
+
+    def _run(self):
+        sampler_id = threading.get_ident()
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                profiles = list(self._active)
+
+            frames = sys._current_frames()
+            for profile in profiles:
+                frame = frames.get(profile.thread_id)
+                if frame is None or profile.thread_id == sampler_id:
+                    continue
+                if _request_is_running(profile, frame):
+                    profile.stacks[_fold_stack(frame)] += 1
+                else:
+                    profile.other_samples += 1
+            time.sleep(self.interval)
+
+
+_current_tasks = getattr(asyncio.tasks, "_current_tasks", None)
+
+
+# True when the sampled stack belongs to the profiled request. The loop's
+# current task is checked first since it also covers SQLAlchemy's greenlets,
+# whose frames don't link back to the task; otherwise the middleware's own
+# frame must be on the stack.
+def _request_is_running(profile, frame):
+    if _current_tasks is not None and profile.loop is not None:
+        return _current_tasks.get(profile.loop) is profile.task
+    while frame is not None:
+        if frame is profile.root_frame:
+            return True
+        frame = frame.f_back
+    return False
+
+
+def _fold_stack(frame):
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+sampler = StackSampler()
+
+
+def _save_profile(profile):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, f"{profile.id}.json"), "w") as f:
+        json.dump(profile.to_dict(), f)
+
+    # Bounded store: drop the oldest profiles beyond PROFILE_MAX_FILES
+    saved = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith(".json"))
+    for name in saved[:-PROFILE_MAX_FILES]:
+        os.remove(os.path.join(PROFILE_DIR, name))
+
+
+def list_profiles():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    summaries = []
+    for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(PROFILE_DIR, name)) as f:
+            data = json.load(f)
+        summaries.append({
+            "id": data["id"],
+            "method": data["method"],
+            "path": data["path"],
+            "status_code": data["status_code"],
+            "started_at": data["started_at"],
+            "duration_ms": data["duration_ms"],
+            "sql_count": len(data["sql"]),
+            "sql_total_ms": data["sql_total_ms"],
+            "llm_count": len(data["llm"]),
+        })
+    return summaries
+
+
+def load_profile(profile_id):
+    path = os.path.join(PROFILE_DIR, f"{os.path.basename(profile_id)}.json")
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def is_profile_admin(token):
+    return bool(PROFILE_TOKEN) and token is not None and hmac.compare_digest(
+        token.encode("latin-1", "replace"), PROFILE_TOKEN.encode("latin-1", "replace")
+    )
+
+
+def _should_profile(scope):
+    if PROFILE_TOKEN:
+        for name, value in scope.get("headers", ()):
+            if name == PROFILE_HEADER:
+                return hmac.compare_digest(value, PROFILE_TOKEN.encode("latin-1", "replace"))
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+class ProfilingMiddleware:
+    # Plain ASGI middleware so unprofiled requests pay only for a header scan
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(
+            scope["method"], scope["path"], threading.get_ident(), asyncio.current_task(), sys._getframe()
+        )
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", profile.id.encode())]
+            await send(message)
+
+        token = current_profile.set(profile)
+        sampler.start(profile)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            sampler.stop(profile)
+            current_profile.reset(token)
+            profile.duration = profile.elapsed()
+            try:
+                await asyncio.to_thread(_save_profile, profile)
+            except OSError as e:
+                print(f"Profiler Error: {e}")
+
+
+# SQL timing via engine events; the statement start time rides on the
+# execution context so concurrent statements don't mix up
+def install_sql_hooks(async_engine):
+    sync_engine = async_engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if current_profile.get() is not None and context is not None:
+            context._profile_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        profile = current_profile.get()
+        if profile is None or context is None or not hasattr(context, "_profile_started"):
+            return
+        profile.sql.append({
+            "statement": statement,
+            "duration_ms": round((time.perf_counter() - context._profile_started) * 1000, 3),
+            "rowcount": cursor.rowcount,
+            "executemany": executemany,
+            "at_ms": round(profile.elapsed() * 1000, 3),
+        })
+
+
+def record_llm_call(provider, duration, ok, error=None):
+    profile = current_profile.get()
+    if profile is None:
+        return
+    profile.llm.append({
+        "provider": provider,
+        "duration_ms": round(duration * 1000, 3),
+        "ok": ok,
+        "error": error,
+        "at_ms": round(profile.elapsed() * 1000, 3),
+    })
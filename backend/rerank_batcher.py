@@ -0,0 +1,228 @@
+import asyncio
+import contextvars
+import json
+import os
+import time
+
+from llm_router import call_log, llm_router, LLMResult
+from request_profiler import record_llm_call
+from traffic_capture import record_llm_exchange
+
+# Micro-batching for the AI rerank stage. Jobs submitted within
+# RERANK_BATCH_WINDOW_MS of each other (or until RERANK_BATCH_MAX_JOBS are
+# waiting) share one LLM call: one system prompt, one deduplicated movie
+# table, and a list of per-user requests that refer to movies by table id.
+# The JSON answer is split back per request. A window with a single job
+# sends that job's own prompt unchanged.
+#
+# Off by default (window 0). A batched prompt carries every waiting user's
+# note, so one note can sway the picks made for the others. Batched answers
+# therefore only return movie ids, never free-text reasons, so nothing from
+# one user's note can be echoed back to another. Enable only where that
+# trade-off is acceptable. Batching is also off during LLM replay, whose
+# captured answers are per request.
+#
+# Every provider call made for a batch (including failures and hedges that
+# lost) is reported to each waiting request's profile and capture, with its
+# real latency.
+
+RERANK_BATCH_WINDOW_MS = float(os.getenv("RERANK_BATCH_WINDOW_MS", "0"))
+RERANK_BATCH_MAX_JOBS = int(os.getenv("RERANK_BATCH_MAX_JOBS", "8"))
+
+BATCH_SYSTEM_PROMPT = (
+    "You are a specialized cinematic consultant answering several users at once. "
+    "Treat every request independently. Output strictly in JSON."
+)
+
+
+class RerankJob:
+    __slots__ = ("system_prompt", "prompt", "temperature", "goal", "user_context", "candidates")
+
+    # system_prompt/prompt: the standalone request, used when the job runs alone
+    # goal: what a good pick means for this route, used in batched prompts
+    # user_context: the user's moods, note, etc.
+    # candidates: [{"title", "year", "keywords"}] the job may choose from
+    def __init__(self, system_prompt, prompt, temperature, goal, user_context, candidates):
+        self.system_prompt = system_prompt
+        self.prompt = prompt
+        self.temperature = temperature
+        self.goal = goal
+        self.user_context = user_context
+        self.candidates = candidates
+
+
+def _movie_key(movie):
+    return (movie["title"].lower().strip(), movie.get("year"))
+
+
+def build_batch_prompt(jobs):
+    movie_table = {}  # movie key -> (table id, movie)
+    requests = []
+    for i, job in enumerate(jobs, start=1):
+        candidate_ids = []
+        for movie in job.candidates:
+            key = _movie_key(movie)
+            if key not in movie_table:
+                movie_table[key] = (f"M{len(movie_table) + 1}", movie)
+            candidate_ids.append(movie_table[key][0])
+        requests.append({
+            "request_id": f"R{i}",
+            "goal": job.goal,
+            **job.user_context,
+            "candidates": candidate_ids,
+        })
+
+    table_lines = "\n    ".join(
+        f"{table_id} | {movie['title']} ({movie.get('year') or '?'}) | {movie.get('keywords') or ''}"
+        for table_id, movie in movie_table.values()
+    )
+    prompt = f"""
+    Several users each need movie recommendations.
+
+    MOVIE TABLE (id | title (year) | keywords), shared by all requests:
+    {table_lines}
+
+    REQUESTS:
+    {json.dumps(requests, ensure_ascii=False)}
+
+    TASK:
+    For every request, pick ONLY from that request's candidates the movies that fit its goal
+    and the user's situation, best fit first. Return movie ids only, no explanations.
+    If nothing fits a request, return an empty list for it.
+
+    JSON OUTPUT FORMAT:
+    {{
+      "results": [
+        {{"request_id": "R1", "movie_ids": ["M1", "M4"]}}
+      ]
+    }}
+    """
+    titles_by_id = {table_id: movie["title"] for table_id, movie in movie_table.values()}
+    allowed = {r["request_id"]: set(r["candidates"]) for r in requests}
+    return prompt, titles_by_id, allowed
+
+
+# {"results": [...]} -> {request_id: [{"title", "reason": ""}]}. Picks outside
+# a request's candidates are dropped and any text the model adds is ignored;
+# a malformed shape raises ValueError so the router can try another provider.
+def parse_batch_results(raw_response, titles_by_id, allowed):
+    if not raw_response:
+        raise ValueError("Empty LLM response")
+
+    parsed_json = json.loads(raw_response)
+    results = parsed_json.get("results") if isinstance(parsed_json, dict) else None
+    if not isinstance(results, list):
+        raise ValueError("Batched LLM response has no results list")
+
+    split = {request_id: [] for request_id in allowed}
+    for entry in results:
+        if not isinstance(entry, dict) or entry.get("request_id") not in allowed:
+            continue
+        request_id = entry["request_id"]
+        picks = entry.get("movie_ids")
+        if not isinstance(picks, list):
+            raise ValueError(f"Malformed results entry: {entry!r}")
+        for movie_id in picks:
+            if movie_id in allowed[request_id]:
+                split[request_id].append({"title": titles_by_id[movie_id], "reason": ""})
+    return split
+
+
+class RerankBatcher:
+    def __init__(self, router, window_ms=RERANK_BATCH_WINDOW_MS, max_jobs=RERANK_BATCH_MAX_JOBS):
+        self.router = router
+        self.window = window_ms / 1000
+        self.max_jobs = max_jobs
+        self.enabled = self.window > 0 and max_jobs > 1 and not os.getenv("LLM_REPLAY_DIR")
+        self._pending = {}   # temperature -> [(job, future)]
+        self._timers = {}
+        self._running = set()
+
+    async def submit(self, job):
+        if not self.enabled:
+            return await self.router.rerank(job.system_prompt, job.prompt, job.temperature)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        queue = self._pending.setdefault(job.temperature, [])
+        queue.append((job, future))
+        if len(queue) >= self.max_jobs:
+            self._flush(job.temperature)
+        elif len(queue) == 1:
+            self._timers[job.temperature] = loop.call_later(self.window, self._flush, job.temperature)
+
+        result, error, calls, elapsed, batch_size = await future
+        self._report(job, result, error, calls, elapsed, batch_size)
+        if error is not None:
+            raise error
+        return result
+
+    # Replays the batch's provider calls into this request's context. For a
+    # real batch, the successful call is captured as this request's own prompt
+    # and its share of the answer, so replay (which runs unbatched) can match it.
+    def _report(self, job, result, error, calls, elapsed, batch_size):
+        suffix = "" if batch_size == 1 else f" (batch of {batch_size})"
+        for call in calls:
+            record_llm_call(call["provider"] + suffix, call["latency"], call["ok"], call["error"])
+            if call["cancelled"] or (call["ok"] and batch_size > 1):
+                continue
+            # A failed batched answer may hold other users' picks, keep only its timing
+            raw_response = call["raw_response"] if batch_size == 1 else None
+            record_llm_exchange(
+                call["provider"] + suffix, call["system_prompt"], call["user_prompt"],
+                raw_response, call["latency"], call["ok"],
+            )
+
+        if error is not None and not calls:
+            record_llm_call("batch" + suffix, elapsed, False, str(error))
+        if result is not None and batch_size > 1:
+            record_llm_exchange(
+                result.provider + suffix, job.system_prompt, job.prompt,
+                json.dumps({"recommendations": result.recommendations}), result.latency, True,
+            )
+
+    def _flush(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, [])
+        if not batch:
+            return
+        # Fresh context so the shared call is not attributed to whichever
+        # request happened to open the window; _report hands it to each one
+        task = contextvars.Context().run(asyncio.create_task, self._run_batch(key, batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run_batch(self, temperature, batch):
+        jobs = [job for job, _ in batch]
+        calls = []
+        call_log.set(calls)
+        started = time.perf_counter()
+        try:
+            if len(jobs) == 1:
+                results = [await self.router.rerank(jobs[0].system_prompt, jobs[0].prompt, temperature)]
+            else:
+                prompt, titles_by_id, allowed = build_batch_prompt(jobs)
+                combined = await self.router.rerank(
+                    BATCH_SYSTEM_PROMPT,
+                    prompt,
+                    temperature,
+                    parse=lambda raw: parse_batch_results(raw, titles_by_id, allowed),
+                )
+                results = [
+                    LLMResult(combined.provider, combined.recommendations[f"R{i}"], combined.latency, len(jobs))
+                    for i in range(1, len(jobs) + 1)
+                ]
+            error = None
+        except Exception as e:
+            results = [None] * len(jobs)
+            error = e
+
+        elapsed = time.perf_counter() - started
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result((result, error, calls, elapsed, len(jobs)))
+
+
+rerank_batcher = RerankBatcher(llm_router)
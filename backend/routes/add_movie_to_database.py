@@ -3,6 +3,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from database import get_db
+from keyword_tags import index_movie_tags
 from models import Movie, Mood, MovieMood
 from schemas import MovieCreate
 
@@ -44,6 +45,9 @@ async def create_movie(movie: MovieCreate, db: AsyncSession = Depends(get_db)):
             )
             db.add(association)
 
+        # Keep the keyword tag index in sync
+        tags = await index_movie_tags(db, new_movie.id, movie.keyword)
+
         # Commit everything
         await db.commit()
 
@@ -55,6 +59,7 @@ async def create_movie(movie: MovieCreate, db: AsyncSession = Depends(get_db)):
             "synopsis": new_movie.synopsis,
             "keyword": new_movie.keyword,
             "moods_recorded": len(movie.moods),
+            "tags": tags,
         }
 
     except Exception as e:
@@ -0,0 +1,40 @@
+import asyncio
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from request_profiler import is_profile_admin, list_profiles, load_profile
+
+router = APIRouter()
+
+
+def require_profile_admin(token):
+    if not is_profile_admin(token):
+        raise HTTPException(status_code=403, detail="Profiling admin token required.")
+
+
+@router.get("/admin/profiles")
+async def get_profiles(x_profile_token: Optional[str] = Header(default=None)):
+    require_profile_admin(x_profile_token)
+    # Profile files can be large, read them off the event loop
+    return await asyncio.to_thread(list_profiles)
+
+
+@router.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, x_profile_token: Optional[str] = Header(default=None)):
+    require_profile_admin(x_profile_token)
+    profile = await asyncio.to_thread(load_profile, profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    return profile
+
+
+# Folded stacks only, ready for flamegraph.pl / speedscope
+@router.get("/admin/profiles/{profile_id}/folded", response_class=PlainTextResponse)
+async def get_profile_folded(profile_id: str, x_profile_token: Optional[str] = Header(default=None)):
+    require_profile_admin(x_profile_token)
+    profile = await asyncio.to_thread(load_profile, profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    return profile["folded_stacks"]
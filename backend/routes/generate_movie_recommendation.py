@@ -1,23 +1,24 @@
-import os
 import traceback
 
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
-
-# Gemini AI 
-from google import genai
 
 from database import get_db
+from keyword_tags import score_note_tag_overlap, apply_tag_overlap, shortlist_for_ai, keyword_match_tier
+from llm_router import RECOMMENDATIONS_JSON_FORMAT
+from rerank_batcher import rerank_batcher, RerankJob
 from models import Movie, Mood, MovieMood
+from movie_rows import MOVIE_COLUMNS, movie_record, fetch_movie_moods, format_movie
 from schemas import MovieRecommendationRequest
-
-# Reads API key from environment variable GEMINI_API_KEY
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+from routes.movie_reviews import fetch_review_stats
+from seen_movies import drop_seen_movies, remember_shown_movies
 
 router = APIRouter()
 
+# Upper bound on movies sent to the LLM in one prompt
+MAX_AI_CANDIDATES = 25
+
 
 @router.post("/movierecommendationuserinput")
 async def receive_user_input(request: MovieRecommendationRequest, db: AsyncSession = Depends(get_db)):
@@ -54,68 +55,60 @@ async def receive_user_input(request: MovieRecommendationRequest, db: AsyncSessi
                 target_mood_strings.extend(repair_targets)
             target_mood_strings = list(set(target_mood_strings))  # remove duplicates
 
-        # STEP 2 Fetch movies with relevant moods
+        # STEP 2 Fetch movies with relevant moods, as plain columns (no ORM hydration)
         stmt = (
-            select(Movie, MovieMood.score, Mood.mood_name)
+            select(*MOVIE_COLUMNS, MovieMood.score, Mood.mood_name)
             .join(MovieMood, Movie.id == MovieMood.movie_id)
             .join(Mood, MovieMood.mood_id == Mood.id)
             .where(Mood.mood_name.in_(target_mood_strings))
-            .options(selectinload(Movie.moods))
         )
         result = await db.execute(stmt)
         rows = result.all()
 
-        # STEP 3 Get all moods for each movie
-        all_moods_stmt = (
-            select(Movie.id, Mood.mood_name, MovieMood.score)
-            .join(MovieMood, Movie.id == MovieMood.movie_id)
-            .join(Mood, MovieMood.mood_id == Mood.id)
-        )
-        all_moods_result = await db.execute(all_moods_stmt)
-        all_moods_rows = all_moods_result.all()
-
-        movie_all_moods = {}
-        for movie_id, mood_name, mood_score in all_moods_rows:
-            movie_all_moods.setdefault(movie_id, []).append({
-                "mood": mood_name,
-                "score": round(float(mood_score or 0), 2)
-            })
-
-        # STEP 4 Aggregate scores per movie, this uses AVERAGE
+        # STEP 3 Aggregate scores per movie, this uses AVERAGE
         movie_scores = {}
-        for movie, mood_score, mood_name in rows:
-            if movie.id not in movie_scores:
-                movie_scores[movie.id] = {
-                    "movie": movie,
+        for row in rows:
+            movie_id = row.id
+            if movie_id not in movie_scores:
+                movie_scores[movie_id] = {
+                    "movie": movie_record(row),
                     "mood_scores_list": [],
                     "matching_moods": []
                 }
-            movie_scores[movie.id]["mood_scores_list"].append(float(mood_score or 0))
-            movie_scores[movie.id]["matching_moods"].append(mood_name)
+            movie_scores[movie_id]["mood_scores_list"].append(float(row.score or 0))
+            movie_scores[movie_id]["matching_moods"].append(row.mood_name)
 
         for movie_id in movie_scores:
             scores = movie_scores[movie_id]["mood_scores_list"]
             movie_scores[movie_id]["total_score"] = round(sum(scores) / len(scores), 2) if scores else 0.0
 
-        # STEP 5 Format matched movies
+        # Skip movies this session was already shown, before formatting or the AI step
+        movie_scores = drop_seen_movies(request.sessionToken, movie_scores)
+
+        # STEP 4 Get all moods for the remaining movies
+        movie_moods = await fetch_movie_moods(db, movie_scores.keys())
+
+        # STEP 5 Format matched movies, review stats come from one batched lookup
+        review_stats = await fetch_review_stats(db, movie_scores.keys())
         matched_movies = []
-        for movie_data in movie_scores.values():
-            movie = movie_data["movie"]
-            total_score = movie_data["total_score"]
-            movie_mood_names = [m.mood_name for m in movie.moods]
-
-            matched_movies.append({
-                "id": movie.id,
-                "title": movie.title,
-                "year": movie.year,
-                "image_url": movie.image_url,
-                "synopsis": movie.synopsis,
-                "keyword": movie.keyword,
-                "moods": movie_mood_names,
-                "mood_scores": movie_all_moods.get(movie.id, []),
-                "match_score": total_score,
-                "ai_selected": False
-            })
+        for movie_id, movie_data in movie_scores.items():
+            moods = movie_moods.get(movie_id, [])
+            matched_movies.append(format_movie(
+                movie_data["movie"],
+                [mood_name for mood_name, _ in moods],
+                mood_scores=[
+                    {"mood": mood_name, "score": round(float(mood_score or 0), 2)}
+                    for mood_name, mood_score in moods
+                ],
+                match_score=movie_data["total_score"],
+                review_stats=review_stats[movie_id],
+                ai_selected=False,
+            ))
+
+        # Keyword tags shared with the user's note boost the AI shortlist and the fallback tier
+        if request.personalNotes:
+            tag_overlap = await score_note_tag_overlap(db, request.personalNotes, movie_scores.keys())
+            apply_tag_overlap(matched_movies, tag_overlap)
 
         # STEP 6 AI 
         ai_selected_movies = []
@@ -124,7 +117,10 @@ async def receive_user_input(request: MovieRecommendationRequest, db: AsyncSessi
         if request.personalNotes and matched_movies:
             matched_movies.sort(key=lambda x: x["match_score"], reverse=True)
 
-            top_movies_for_ai = [m for m in matched_movies if m["match_score"] >= 0.7]
+            top_movies_for_ai = shortlist_for_ai(
+                [m for m in matched_movies if m["match_score"] >= 0.7 or m["tag_score"] > 0],
+                MAX_AI_CANDIDATES,
+            )
 
             # Fallback to top 5 if No movies are >= 0.7 to make sure AI gets something just in case
             if not top_movies_for_ai:
@@ -136,6 +132,7 @@ async def receive_user_input(request: MovieRecommendationRequest, db: AsyncSessi
                         "id": m["id"],
                         "title": m["title"],
                         "year": m["year"],
+                        "matched_keywords": m["matched_tags"],
                     }
                     for m in top_movies_for_ai
                 ]
@@ -153,18 +150,28 @@ async def receive_user_input(request: MovieRecommendationRequest, db: AsyncSessi
                 Movies to evaluate:
                 {ai_input_data}
 
-                Return ONLY a comma-separated list of the movie titles that best fit, first entry should be the best fit, second, etc.
-                If none are relevant, return "NONE".
+                Return the movies that best fit, first entry should be the best fit, second, etc.
+                If none are relevant, return an empty "recommendations" list.
+
+                JSON OUTPUT FORMAT:
+                {RECOMMENDATIONS_JSON_FORMAT}
                 """
                 try:
-                    response = await client.aio.models.generate_content(
-                        model='gemini-2.0-flash',
-                        contents=prompt
-                    )
-
-                    selected_titles = []
-                    if response and response.text and response.text.strip().upper() != "NONE":
-                        selected_titles = [t.strip().lower() for t in response.text.strip().split(',')]
+                    ai_result = await rerank_batcher.submit(RerankJob(
+                        "You are a cinematic consultant matching movies to how people feel. Output strictly in JSON.",
+                        prompt,
+                        0.3,
+                        goal=(
+                            "Pick movies whose keywords best fit the user's note. For 'congruence' match their "
+                            "current emotional state, for 'repair' pick movies that could shift their mood positively."
+                        ),
+                        user_context={"note": request.personalNotes, "preference": request.preference},
+                        candidates=[
+                            {"title": m["title"], "year": m["year"], "keywords": m["keyword"]}
+                            for m in top_movies_for_ai
+                        ],
+                    ))
+                    selected_titles = [r["title"].lower() for r in ai_result.recommendations]
 
                     for movie in matched_movies:
                         if movie["title"].lower() in selected_titles:
@@ -186,13 +193,20 @@ async def receive_user_input(request: MovieRecommendationRequest, db: AsyncSessi
         # STEP 7 Sort non-selected tier by score
         non_selected_movies.sort(key=lambda x: x["match_score"], reverse=True)
 
+        # When the AI picked nothing (skipped, failed or none relevant), keyword matches lead
+        keyword_matched_movies = []
+        if request.personalNotes and not ai_selected_movies:
+            keyword_matched_movies, non_selected_movies = keyword_match_tier(non_selected_movies)
+
         # STEP 8 Combine final sequence
-        final_movies = ai_selected_movies + non_selected_movies
+        final_movies = ai_selected_movies + keyword_matched_movies + non_selected_movies
+        remember_shown_movies(request.sessionToken, final_movies)
 
         return {
             "preference": request.preference,
             "target_moods": target_mood_strings,
             "ai_selected_count": len(ai_selected_movies),
+            "keyword_match_count": len(keyword_matched_movies),
             "movies": final_movies
         }
 
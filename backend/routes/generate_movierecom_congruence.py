@@ -1,23 +1,22 @@
-import os
-import json
 import traceback
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
-
-# Import Groq
-from groq import AsyncGroq
 
 from database import get_db
+from keyword_tags import score_note_tag_overlap, apply_tag_overlap, shortlist_for_ai, keyword_match_tier
+from rerank_batcher import rerank_batcher, RerankJob
 from models import Movie, Mood, MovieMood
+from movie_rows import MOVIE_COLUMNS, movie_record, fetch_movie_moods, format_movie
 from schemas import MovieRecommendationRequest
-
-# Initialize Groq Client
-client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"))
+from routes.movie_reviews import fetch_review_stats
+from seen_movies import drop_seen_movies, remember_shown_movies
 
 router = APIRouter()
 
+# Upper bound on movies sent to the LLM in one prompt
+MAX_AI_CANDIDATES = 25
+
 @router.post("/movierecommendation/congruence")
 async def get_congruence_ai_recommendations(
     request: MovieRecommendationRequest, 
@@ -33,11 +32,10 @@ async def get_congruence_ai_recommendations(
 
         # Fetch movies from DB
         queryMMM = (
-            select(Movie, MovieMood.score, Mood.mood_name)
+            select(*MOVIE_COLUMNS, MovieMood.score, Mood.mood_name)
             .join(MovieMood, Movie.id == MovieMood.movie_id)
             .join(Mood, MovieMood.mood_id == Mood.id)
             .where(Mood.mood_name.in_(target_mood_strings))
-            .options(selectinload(Movie.moods))
         )
         
         result = await db.execute(queryMMM)
@@ -45,40 +43,47 @@ async def get_congruence_ai_recommendations(
 
         # Aggregate
         movie_scores = {}
-        for movie, mood_score, mood_name in rows:
-            if movie.id not in movie_scores:
-                movie_scores[movie.id] = {
-                    "movie": movie,
+        for row in rows:
+            if row.id not in movie_scores:
+                movie_scores[row.id] = {
+                    "movie": movie_record(row),
                     "mood_scores_list": [],
                 }
-            movie_scores[movie.id]["mood_scores_list"].append(float(mood_score or 0))
+            movie_scores[row.id]["mood_scores_list"].append(float(row.score or 0))
 
+        # Skip movies this session was already shown, before formatting or the AI step
+        movie_scores = drop_seen_movies(request.sessionToken, movie_scores)
+
+        movie_moods = await fetch_movie_moods(db, movie_scores.keys())
+        review_stats = await fetch_review_stats(db, movie_scores.keys())
         matched_movies = []
         for movie_id, data in movie_scores.items():
             movie = data["movie"]
             avg_match_score = round(sum(data["mood_scores_list"]) / len(data["mood_scores_list"]), 2)
 
-            matched_movies.append({
-                "id": movie.id,
-                "title": movie.title,
-                "year": movie.year,
-                "image_url": movie.image_url,
-                "synopsis": movie.synopsis,
-                "keyword": movie.keyword,
-                "moods": [m.mood_name for m in movie.moods],
-                "match_score": avg_match_score,
-                "ai_selected": False
-            })
-
-        # AI Selection (Groq Mirroring)
+            matched_movies.append(format_movie(
+                movie,
+                [mood_name for mood_name, _ in movie_moods.get(movie_id, [])],
+                match_score=avg_match_score,
+                review_stats=review_stats[movie_id],
+                ai_selected=False,
+            ))
+
+        # Keyword tags shared with the user's note decide which movies the AI sees
+        if request.personalNotes:
+            tag_overlap = await score_note_tag_overlap(db, request.personalNotes, movie_scores.keys())
+            apply_tag_overlap(matched_movies, tag_overlap)
+
+        # AI Selection (Mirroring, batched and routed through rerank_batcher)
         ai_selected_movies = []
         non_selected_movies = []
 
         if request.personalNotes and matched_movies:
-            # We send ALL matched movies and their keywords
+            # Shortlist: keyword matches first, then the best mood matches
+            candidates_for_ai = shortlist_for_ai(matched_movies, MAX_AI_CANDIDATES)
             movie_data_for_ai = [
                 {"title": m["title"], "keywords": m["keyword"]} 
-                for m in matched_movies
+                for m in candidates_for_ai
             ]
 
             prompt = f"""
@@ -88,7 +93,7 @@ async def get_congruence_ai_recommendations(
             - Psychological Goal: "Congruence" (Mirror and validate their current state)
 
             TASK:
-            Act as a cinematic therapist. Review the provided list of {len(matched_movies)} movies. 
+            Act as a cinematic therapist. Review the provided list of {len(candidates_for_ai)} movies. 
             Identify ALL films that 'mirror' the user's current emotional world. 
             Do NOT try to change their mood or cheer them up. Find stories that say "I hear you."
 
@@ -111,49 +116,56 @@ async def get_congruence_ai_recommendations(
             """
 
             try:
-                chat_completion = await client.chat.completions.create(
-                    messages=[
-                        {
-                            "role": "system", 
-                            "content": "You are a specialized cinematic consultant focusing on emotional validation. Output strictly in JSON."
-                        },
-                        {"role": "user", "content": prompt}
+                ai_result = await rerank_batcher.submit(RerankJob(
+                    "You are a specialized cinematic consultant focusing on emotional validation. Output strictly in JSON.",
+                    prompt,
+                    0.4,
+                    goal=(
+                        "Congruence: mirror and validate the user's current emotional state, do not try to cheer "
+                        "them up."
+                    ),
+                    user_context={"current_state": target_mood_strings, "note": request.personalNotes},
+                    candidates=[
+                        {"title": m["title"], "year": m["year"], "keywords": m["keyword"]}
+                        for m in candidates_for_ai
                     ],
-                    model="llama-3.3-70b-versatile",
-                    temperature=0.4,
-                    response_format={"type": "json_object"}
-                )
-                
-                raw_response = chat_completion.choices[0].message.content
-                parsed_json = json.loads(raw_response)
-                
-                ai_recommendations = parsed_json.get("recommendations", parsed_json.get("movies", []))
-                reason_map = {item["title"].lower().strip(): item["reason"] for item in ai_recommendations}
+                ))
+                reason_map = {item["title"].lower(): item["reason"] for item in ai_result.recommendations}
 
                 for m in matched_movies:
                     m_title_cleaned = m["title"].lower().strip()
                     if m_title_cleaned in reason_map:
                         m["ai_selected"] = True
-                        m["match_score"] = f"AI Recommended: {reason_map[m_title_cleaned]}"
+                        m["match_score"] = f"AI Recommended: {reason_map[m_title_cleaned]}" if reason_map[m_title_cleaned] else "AI Recommended"
                         ai_selected_movies.append(m)
                     else:
                         non_selected_movies.append(m)
             
             except Exception as ai_err:
-                print(f"GROQ ERROR (Congruence): {ai_err}")
+                print(f"AI ERROR (Congruence): {ai_err}")
                 non_selected_movies = matched_movies
         else:
             non_selected_movies = matched_movies
 
         # Final sequence
+        non_selected_movies = sorted(
+            non_selected_movies, 
+            key=lambda x: x["match_score"] if isinstance(x["match_score"], (int, float)) else 0, 
+            reverse=True
+        )
+
+        # When the AI picked nothing (skipped, failed or none relevant), keyword matches lead
+        keyword_matched_movies = []
+        if request.personalNotes and not ai_selected_movies:
+            keyword_matched_movies, non_selected_movies = keyword_match_tier(non_selected_movies)
+
+        final_movies = ai_selected_movies + keyword_matched_movies + non_selected_movies
+        remember_shown_movies(request.sessionToken, final_movies)
+
         return {
             "preference": "congruence",
             "target_moods": target_mood_strings,
-            "movies": ai_selected_movies + sorted(
-                non_selected_movies, 
-                key=lambda x: x["match_score"] if isinstance(x["match_score"], (int, float)) else 0, 
-                reverse=True
-            )
+            "movies": final_movies
         }
 
     except Exception as e:
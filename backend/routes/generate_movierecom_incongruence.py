@@ -1,23 +1,22 @@
-import os
-import json
 import traceback
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
-
-# Import Groq
-from groq import AsyncGroq
 
 from database import get_db
+from keyword_tags import score_note_tag_overlap, apply_tag_overlap, shortlist_for_ai, keyword_match_tier
+from rerank_batcher import rerank_batcher, RerankJob
 from models import Movie, Mood, MovieMood
+from movie_rows import MOVIE_COLUMNS, movie_record, fetch_movie_moods, format_movie
 from schemas import MovieRecommendationRequest
-
-# Initialize Groq Client
-client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"))
+from routes.movie_reviews import fetch_review_stats
+from seen_movies import drop_seen_movies, remember_shown_movies
 
 router = APIRouter()
 
+# Upper bound on movies sent to the LLM in one prompt
+MAX_AI_CANDIDATES = 25
+
 @router.post("/movierecommendation/incongruence")
 async def get_incongruence_recommendations(
     request: MovieRecommendationRequest, 
@@ -58,52 +57,58 @@ async def get_incongruence_recommendations(
 
         # Fetch movies matching the REPAIR moods from Database
         stmt = (
-            select(Movie, MovieMood.score, Mood.mood_name)
+            select(*MOVIE_COLUMNS, MovieMood.score, Mood.mood_name)
             .join(MovieMood, Movie.id == MovieMood.movie_id)
             .join(Mood, MovieMood.mood_id == Mood.id)
             .where(Mood.mood_name.in_(target_mood_strings))
-            .options(selectinload(Movie.moods))
         )
         result = await db.execute(stmt)
         rows = result.all()
 
         # Aggregate scores
         movie_scores = {}
-        for movie, mood_score, mood_name in rows:
-            if movie.id not in movie_scores:
-                movie_scores[movie.id] = {
-                    "movie": movie,
+        for row in rows:
+            if row.id not in movie_scores:
+                movie_scores[row.id] = {
+                    "movie": movie_record(row),
                     "mood_scores_list": [],
                 }
-            movie_scores[movie.id]["mood_scores_list"].append(float(mood_score or 0))
+            movie_scores[row.id]["mood_scores_list"].append(float(row.score or 0))
+
+        # Skip movies this session was already shown, before formatting or the AI step
+        movie_scores = drop_seen_movies(request.sessionToken, movie_scores)
 
+        movie_moods = await fetch_movie_moods(db, movie_scores.keys())
+        review_stats = await fetch_review_stats(db, movie_scores.keys())
         matched_movies = []
         for movie_id, data in movie_scores.items():
             movie = data["movie"]
             avg_score = sum(data["mood_scores_list"]) / len(data["mood_scores_list"])
             
-            matched_movies.append({
-                "id": movie.id,
-                "title": movie.title,
-                "year": movie.year,
-                "image_url": movie.image_url,
-                "synopsis": movie.synopsis,
-                "keyword": movie.keyword,
-                "moods": [m.mood_name for m in movie.moods],
-                "match_score": round(avg_score, 2),
-                "ai_selected": False,
-                "ai_reason": None  # Placeholder for the reason
-            })
-
-        # AI Selection (Groq Implementation)
+            matched_movies.append(format_movie(
+                movie,
+                [mood_name for mood_name, _ in movie_moods.get(movie_id, [])],
+                match_score=round(avg_score, 2),
+                review_stats=review_stats[movie_id],
+                ai_selected=False,
+                ai_reason=None,  # Placeholder for the reason
+            ))
+
+        # Keyword tags shared with the user's note decide which movies the AI sees
+        if request.personalNotes:
+            tag_overlap = await score_note_tag_overlap(db, request.personalNotes, movie_scores.keys())
+            apply_tag_overlap(matched_movies, tag_overlap)
+
+        # AI Selection (batched and routed through rerank_batcher)
         ai_selected_movies = []
         non_selected_movies = []
 
         if request.personalNotes and matched_movies:
-            # We send all titles + keywords to the AI for analysis
+            # Shortlist: keyword matches first, then the best mood matches
+            candidates_for_ai = shortlist_for_ai(matched_movies, MAX_AI_CANDIDATES)
             movie_data_for_ai = [
                 {"title": m["title"], "keywords": m["keyword"]} 
-                for m in matched_movies
+                for m in candidates_for_ai
             ]
 
             prompt = f"""
@@ -113,7 +118,7 @@ async def get_incongruence_recommendations(
             - Psychological Goal: "Mood Incongruence Repair" (Shift user to {target_mood_strings})
 
             TASK:
-            Act as an expert cinematic therapist. Review the provided list of {len(matched_movies)} movies. 
+            Act as an expert cinematic therapist. Review the provided list of {len(candidates_for_ai)} movies. 
             Identify ALL films from this list that serve as an effective emotional 'antidote' or helpful 
             distraction for the user's specific situation. Do not limit yourself to a specific number or the keywords provided; 
             Also do a reseach on what the movie is about, and if a movie is a high-quality match, select it.
@@ -137,58 +142,61 @@ async def get_incongruence_recommendations(
             """
 
             try:
-                # Call Groq API with JSON mode
-                chat_completion = await client.chat.completions.create(
-                    messages=[
-                        {"role": "system", "content": "You are a helpful assistant that only outputs valid JSON lists."},
-                        {"role": "user", "content": prompt}
+                # May share one LLM call with other users' requests; routed to
+                # whichever provider answers first with valid JSON
+                ai_result = await rerank_batcher.submit(RerankJob(
+                    "You are a helpful assistant that only outputs valid JSON lists.",
+                    prompt,
+                    0.3, # Low temp for consistency
+                    goal=(
+                        f"Mood incongruence repair: pick movies that act as an emotional antidote or helpful "
+                        f"distraction, shifting the user toward {target_mood_strings}."
+                    ),
+                    user_context={"current_state": request.moods, "note": request.personalNotes},
+                    candidates=[
+                        {"title": m["title"], "year": m["year"], "keywords": m["keyword"]}
+                        for m in candidates_for_ai
                     ],
-                    model="llama-3.3-70b-versatile",
-                    temperature=0.3, # Low temp for consistency
-                    response_format={"type": "json_object"}
-                )
-                
-                raw_response = chat_completion.choices[0].message.content
-                print(f"DEBUG: Groq raw output: {raw_response}")
-
-                # Groq sometimes wraps the list in a key like {"movies": [...]}
-                parsed_json = json.loads(raw_response)
-                if isinstance(parsed_json, dict) and "movies" in parsed_json:
-                    ai_recommendations = parsed_json["movies"]
-                elif isinstance(parsed_json, list):
-                    ai_recommendations = parsed_json
-                else:
-                    # If it returned a dict but not the list, look for any list inside
-                    ai_recommendations = next((v for v in parsed_json.values() if isinstance(v, list)), [])
+                ))
 
                 # Create a lookup for reasons
-                reason_map = {item["title"].lower(): item["reason"] for item in ai_recommendations}
+                reason_map = {item["title"].lower(): item["reason"] for item in ai_result.recommendations}
 
                 for m in matched_movies:
                     m_title_lower = m["title"].lower()
                     if m_title_lower in reason_map:
                         m["ai_selected"] = True
                         # This displays the "Why" in your UI
-                        m["match_score"] = f"AI Recommended: {reason_map[m_title_lower]}"
+                        m["match_score"] = f"AI Recommended: {reason_map[m_title_lower]}" if reason_map[m_title_lower] else "AI Recommended"
                         ai_selected_movies.append(m)
                     else:
                         non_selected_movies.append(m)
             
             except Exception as ai_err:
-                print(f"AI ERROR (Groq): {ai_err}")
+                print(f"AI ERROR (Incongruence): {ai_err}")
                 non_selected_movies = matched_movies
         else:
             non_selected_movies = matched_movies
 
         # Final Return: AI picks first, then standard DB picks
+        non_selected_movies = sorted(
+            non_selected_movies, 
+            key=lambda x: x["match_score"] if isinstance(x["match_score"], (int, float)) else 0, 
+            reverse=True
+        )
+
+        # When the AI picked nothing (skipped, failed or none relevant), keyword matches lead
+        keyword_matched_movies = []
+        if request.personalNotes and not ai_selected_movies:
+            keyword_matched_movies, non_selected_movies = keyword_match_tier(non_selected_movies)
+
+        final_movies = ai_selected_movies + keyword_matched_movies + non_selected_movies
+        remember_shown_movies(request.sessionToken, final_movies)
+
         return {
             "mode": "incongruence_repair",
             "target_moods": target_mood_strings,
-            "movies": ai_selected_movies + sorted(
-                non_selected_movies, 
-                key=lambda x: x["match_score"] if isinstance(x["match_score"], (int, float)) else 0, 
-                reverse=True
-            )
+            "movies": final_movies
         }
 
     except Exception as e:
@@ -0,0 +1,136 @@
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from database import get_db
+from models import Movie, Review, MovieReviewStats
+from schemas import ReviewCreate
+
+router = APIRouter()
+
+EMPTY_REVIEW_STATS = {"review_count": 0, "rating_count": 0, "average_rating": None}
+
+
+def format_review(review):
+    return {
+        "id": review.id,
+        "movie_id": review.movie_id,
+        "review": review.review,
+        "rating": review.rating,
+        "created_at": review.created_at,
+    }
+
+
+def format_review_stats(stats):
+    if stats is None:
+        return dict(EMPTY_REVIEW_STATS)
+    return {
+        "review_count": stats.review_count,
+        "rating_count": stats.rating_count,
+        "average_rating": round(stats.rating_sum / stats.rating_count, 2) if stats.rating_count else None,
+    }
+
+
+# Batch lookup used by search and recommendation routes: one IN query for the
+# whole result set, movies without reviews get zeroed stats
+async def fetch_review_stats(db: AsyncSession, movie_ids):
+    movie_ids = list(set(movie_ids))
+    if not movie_ids:
+        return {}
+
+    result = await db.execute(
+        select(MovieReviewStats).where(MovieReviewStats.movie_id.in_(movie_ids))
+    )
+    stats_by_movie = {stats.movie_id: stats for stats in result.scalars().all()}
+    return {movie_id: format_review_stats(stats_by_movie.get(movie_id)) for movie_id in movie_ids}
+
+
+@router.post("/api/movies/{movie_id}/reviews")
+async def create_review(movie_id: int, review: ReviewCreate, db: AsyncSession = Depends(get_db)):
+    review_text = review.review.strip()
+    if not review_text:
+        raise HTTPException(status_code=400, detail="Review cannot be empty.")
+
+    movie_exists = await db.scalar(select(Movie.id).where(Movie.id == movie_id))
+    if movie_exists is None:
+        raise HTTPException(status_code=404, detail="Movie not found.")
+
+    try:
+        new_review = Review(
+            movie_id=movie_id,
+            review=review_text,
+            rating=review.rating,
+            created_at=datetime.utcnow(),
+        )
+        db.add(new_review)
+        await db.flush()  # generates new_review.id
+
+        # Bump the summary row in the same transaction; the upsert increments
+        # in SQL so concurrent posts for the same movie don't lose updates
+        has_rating = 1 if review.rating is not None else 0
+        stats_upsert = insert(MovieReviewStats).values(
+            movie_id=movie_id,
+            review_count=1,
+            rating_count=has_rating,
+            rating_sum=review.rating or 0,
+            last_review_at=new_review.created_at,
+        )
+        stats_upsert = stats_upsert.on_conflict_do_update(
+            index_elements=[MovieReviewStats.movie_id],
+            set_={
+                "review_count": MovieReviewStats.review_count + 1,
+                "rating_count": MovieReviewStats.rating_count + has_rating,
+                "rating_sum": MovieReviewStats.rating_sum + (review.rating or 0),
+                "last_review_at": stats_upsert.excluded.last_review_at,
+            },
+        )
+        await db.execute(stats_upsert)
+
+        await db.commit()
+        return format_review(new_review)
+
+    except Exception as e:
+        await db.rollback()
+        print(f"Review Error: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to save review: {str(e)}")
+
+
+# Keyset pagination: pass the previous page's next_cursor as `before` to get
+# the next (older) page without OFFSET scans
+@router.get("/api/movies/{movie_id}/reviews")
+async def list_reviews(
+    movie_id: int,
+    before: Optional[int] = None,
+    limit: int = Query(default=20, ge=1, le=100),
+    db: AsyncSession = Depends(get_db),
+):
+    try:
+        stmt = select(Review).where(Review.movie_id == movie_id)
+        if before is not None:
+            stmt = stmt.where(Review.id < before)
+        stmt = stmt.order_by(Review.id.desc()).limit(limit + 1)
+
+        result = await db.execute(stmt)
+        reviews = result.scalars().all()
+
+        has_more = len(reviews) > limit
+        reviews = reviews[:limit]
+
+        stats = await db.scalar(
+            select(MovieReviewStats).where(MovieReviewStats.movie_id == movie_id)
+        )
+
+        return {
+            "movie_id": movie_id,
+            "reviews": [format_review(r) for r in reviews],
+            "next_cursor": reviews[-1].id if has_more else None,
+            "review_stats": format_review_stats(stats),
+        }
+
+    except Exception as e:
+        print(f"Review List Error: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to list reviews: {str(e)}")
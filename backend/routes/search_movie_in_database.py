@@ -1,10 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
 
 from database import get_db
 from models import Movie
+from movie_rows import SEARCH_MOVIE_COLUMNS, SearchMovieRecord, fetch_movie_moods, format_movie
+from routes.movie_reviews import fetch_review_stats
 
 router = APIRouter()
 
@@ -12,27 +13,24 @@ router = APIRouter()
 @router.get("/api/movies/search")
 async def search_movies_by_title(title: str, db: AsyncSession = Depends(get_db)):
     try:
-        # Execute query with eager loading for moods only
+        # Column select straight into records, moods come from one batched lookup
         result = await db.execute(
-            select(Movie)
+            select(*SEARCH_MOVIE_COLUMNS)
             .where(Movie.title.ilike(f"%{title}%"))
-            .options(selectinload(Movie.moods))
             .order_by(Movie.created_at.desc())
         )
-        movies = result.scalars().all()
+        movies = [SearchMovieRecord._make(row) for row in result.all()]
+        movie_ids = [movie.id for movie in movies]
+        movie_moods = await fetch_movie_moods(db, movie_ids)
+        review_stats = await fetch_review_stats(db, movie_ids)
 
         # Format the response
         return [
-            {
-                "id": movie.id,
-                "title": movie.title,
-                "year": movie.year,
-                "synopsis": movie.synopsis,
-                "storyline": movie.storyline,
-                "image_url": movie.image_url,
-                "created_at": movie.created_at,
-                "moods": [m.mood_name for m in movie.moods],
-            }
+            format_movie(
+                movie,
+                [mood_name for mood_name, _ in movie_moods.get(movie.id, [])],
+                review_stats=review_stats[movie.id],
+            )
             for movie in movies
         ]
 
@@ -41,4 +39,4 @@ async def search_movies_by_title(title: str, db: AsyncSession = Depends(get_db))
         raise HTTPException(
             status_code=500,
             detail=f"Failed to search movies by title: {str(e)}",
-        )
\ No newline at end of file
+        )
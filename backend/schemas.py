@@ -1,5 +1,5 @@
 from typing import List, Dict, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 # Pydantic models for request validation
 class MovieRecommendationRequest(BaseModel):
@@ -7,6 +7,7 @@ class MovieRecommendationRequest(BaseModel):
     preference: str
     personalNotes: Optional[str] = ""
     timestamp: Optional[str] = None
+    sessionToken: Optional[str] = None  # Lets repeat requests skip movies already shown
 
 class MovieCreate(BaseModel):
     title: str
@@ -14,4 +15,8 @@ class MovieCreate(BaseModel):
     year: int
     synopsis: str
     keyword: str
-    moods: Dict[str, float]
\ No newline at end of file
+    moods: Dict[str, float]
+
+class ReviewCreate(BaseModel):
+    review: str
+    rating: Optional[int] = Field(default=None, ge=1, le=5)
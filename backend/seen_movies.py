@@ -0,0 +1,101 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+# Per-session memory of which movies were already recommended, so refreshing
+# the recommendation page surfaces new titles instead of the same top results.
+# Each session holds a small Bloom filter over movie ids (256 bytes), entries
+# expire after SESSION_TTL_SECONDS of inactivity.
+
+FILTER_BITS = 2048
+FILTER_HASHES = 4
+SESSION_TTL_SECONDS = 30 * 60
+MAX_SESSIONS = 10000
+
+# How many of the top movies in a response count as "shown" to the user
+SHOWN_PER_REQUEST = 10
+
+
+class SeenMovieFilter:
+    __slots__ = ("bits",)
+
+    def __init__(self):
+        self.bits = bytearray(FILTER_BITS // 8)
+
+    def _positions(self, movie_id):
+        digest = hashlib.blake2b(str(movie_id).encode(), digest_size=FILTER_HASHES * 4).digest()
+        for i in range(FILTER_HASHES):
+            yield int.from_bytes(digest[i * 4:(i + 1) * 4], "little") % FILTER_BITS
+
+    def add(self, movie_id):
+        for pos in self._positions(movie_id):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    # False positives are possible (a movie is rarely skipped when it was never
+    # shown), false negatives are not
+    def __contains__(self, movie_id):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(movie_id))
+
+
+class SeenMovieStore:
+    def __init__(self, ttl_seconds=SESSION_TTL_SECONDS, max_sessions=MAX_SESSIONS):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        # session token -> (filter, last access time), oldest access first
+        self._sessions = OrderedDict()
+
+    def _evict_expired(self, now):
+        while self._sessions:
+            token, (_, last_seen) = next(iter(self._sessions.items()))
+            if now - last_seen < self.ttl_seconds and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[token]
+
+    def get(self, session_token):
+        if not session_token:
+            return None
+        now = time.monotonic()
+        self._evict_expired(now)
+        entry = self._sessions.get(session_token)
+        if entry is None:
+            return None
+        self._sessions[session_token] = (entry[0], now)
+        self._sessions.move_to_end(session_token)
+        return entry[0]
+
+    def mark_seen(self, session_token, movie_ids):
+        if not session_token:
+            return
+        seen = self.get(session_token)
+        if seen is None:
+            seen = SeenMovieFilter()
+            self._sessions[session_token] = (seen, time.monotonic())
+            self._evict_expired(time.monotonic())
+        for movie_id in movie_ids:
+            seen.add(movie_id)
+
+    def reset(self, session_token):
+        self._sessions.pop(session_token, None)
+
+
+seen_movie_store = SeenMovieStore()
+
+
+# Drops movies this session was already shown from the aggregated
+# {movie_id: data} candidates. If everything has been seen, the session starts
+# over rather than returning an empty list.
+def drop_seen_movies(session_token, movie_scores):
+    seen = seen_movie_store.get(session_token)
+    if seen is None:
+        return movie_scores
+
+    unseen = {movie_id: data for movie_id, data in movie_scores.items() if movie_id not in seen}
+    if not unseen:
+        seen_movie_store.reset(session_token)
+        return movie_scores
+    return unseen
+
+
+# Records the top of the final ordered list as shown for this session
+def remember_shown_movies(session_token, movies):
+    seen_movie_store.mark_seen(session_token, [m["id"] for m in movies[:SHOWN_PER_REQUEST]])
@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+from llm_router import LLMProvider, LLMRouter, MIN_LATENCY_SAMPLES
+
+
+class FakeProvider(LLMProvider):
+    def __init__(self, name, delay, error=None, seeded_latency=None):
+        super().__init__()
+        self.name = name
+        self.delay = delay
+        self.error = error
+        if seeded_latency is not None:
+            self.latencies.extend([seeded_latency] * MIN_LATENCY_SAMPLES)
+
+    async def complete(self, system_prompt, user_prompt, temperature):
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return json.dumps({"recommendations": [{"title": self.name, "reason": ""}]})
+
+
+def _rerank(*providers):
+    router = LLMRouter(providers)
+    router._provider_order = lambda: list(providers)
+    return asyncio.run(router.rerank("system", "prompt"))
+
+
+def test_hedge_cancelled_early_does_not_lower_its_p90():
+    primary = FakeProvider("a", 0.3, seeded_latency=0.05)
+    hedge = FakeProvider("b", 1.0, seeded_latency=1.0)
+
+    for _ in range(3):
+        result = _rerank(primary, hedge)
+        assert result.provider == "a"
+
+    assert list(hedge.latencies) == [1.0] * MIN_LATENCY_SAMPLES
+    assert hedge.p90_latency() == 1.0
+
+
+def test_cancelled_primary_slower_than_p90_raises_it():
+    primary = FakeProvider("a", 1.0, seeded_latency=0.05)
+    hedge = FakeProvider("b", 0.05, seeded_latency=0.05)
+
+    result = _rerank(primary, hedge)
+
+    assert result.provider == "b"
+    assert len(primary.latencies) == MIN_LATENCY_SAMPLES + 1
+    assert primary.latencies[-1] > 0.2
+
+
+def test_fast_failure_is_kept_out_of_the_latency_window():
+    failing = FakeProvider("a", 0.0, error=RuntimeError("401 Unauthorized"), seeded_latency=1.0)
+    fallback = FakeProvider("b", 0.05)
+
+    result = _rerank(failing, fallback)
+
+    assert result.provider == "b"
+    assert list(failing.latencies) == [1.0] * MIN_LATENCY_SAMPLES
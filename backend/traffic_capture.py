@@ -0,0 +1,230 @@
+import asyncio
+import contextvars
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import event
+
+# Opt-in traffic capture for the recommendation and search endpoints, used by
+# replay_traffic.py to re-run real request shapes against another build.
+# Enabled with TRAFFIC_CAPTURE=1. Each captured request becomes one JSONL
+# line in CAPTURE_DIR holding:
+# - the sanitized request (emails/phone numbers redacted from notes, session
+#   tokens replaced by a stable hash)
+# - a response summary (status, ordered movie ids, AI-selected ids)
+# - stage timings (total, SQL, LLM)
+# - every LLM exchange (prompt hash, provider, latency, raw response), so a
+#   replay can answer LLM calls without calling a provider
+# Files rotate at CAPTURE_MAX_BYTES and only the newest CAPTURE_MAX_FILES
+# are kept.
+
+TRAFFIC_CAPTURE = os.getenv("TRAFFIC_CAPTURE", "0") == "1"
+CAPTURE_DIR = os.getenv("CAPTURE_DIR", "captures")
+CAPTURE_MAX_BYTES = int(os.getenv("CAPTURE_MAX_BYTES", str(10 * 1024 * 1024)))
+CAPTURE_MAX_FILES = int(os.getenv("CAPTURE_MAX_FILES", "20"))
+
+CAPTURED_PATHS = frozenset({
+    "/movierecommendationuserinput",
+    "/movierecommendation/congruence",
+    "/movierecommendation/incongruence",
+    "/api/movies/search",
+})
+
+# Sent by replay_traffic.py so the target can look up captured LLM answers
+REPLAY_HEADER = b"x-replay-id"
+
+current_capture = contextvars.ContextVar("current_capture", default=None)
+current_replay_id = contextvars.ContextVar("current_replay_id", default=None)
+
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+_PHONE_RE = re.compile(r"\+?\d[\d\s().-]{7,}\d")
+
+
+def prompt_hash(system_prompt, user_prompt):
+    return hashlib.sha256(f"{system_prompt}\x00{user_prompt}".encode()).hexdigest()[:16]
+
+
+def _token_hash(token):
+    return "sess-" + hashlib.sha256(token.encode()).hexdigest()[:16]
+
+
+def sanitize_body(body):
+    if not isinstance(body, dict):
+        return body
+    body = dict(body)
+    if body.get("personalNotes"):
+        notes = _EMAIL_RE.sub("[email]", body["personalNotes"])
+        body["personalNotes"] = _PHONE_RE.sub("[phone]", notes)
+    if body.get("sessionToken"):
+        body["sessionToken"] = _token_hash(body["sessionToken"])
+    return body
+
+
+def summarize_response(body):
+    movies = body.get("movies", []) if isinstance(body, dict) else body
+    if not isinstance(movies, list):
+        return {}
+    return {
+        "movie_ids": [m.get("id") for m in movies if isinstance(m, dict)],
+        "ai_selected_ids": [m.get("id") for m in movies if isinstance(m, dict) and m.get("ai_selected")],
+    }
+
+
+class RotatingJsonlWriter:
+    def __init__(self, directory, max_bytes, max_files):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        self._path = None
+
+    def _rotate(self):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+        self._path = os.path.join(self.directory, f"capture-{stamp}-{uuid.uuid4().hex[:6]}.jsonl")
+
+        existing = sorted(glob.glob(os.path.join(self.directory, "capture-*.jsonl")))
+        for path in existing[:-(self.max_files - 1) or None]:
+            os.remove(path)
+
+    def write(self, record):
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            if self._path is None or (
+                os.path.exists(self._path) and os.path.getsize(self._path) + len(line) > self.max_bytes
+            ):
+                self._rotate()
+            with open(self._path, "a") as f:
+                f.write(line)
+
+
+writer = RotatingJsonlWriter(CAPTURE_DIR, CAPTURE_MAX_BYTES, CAPTURE_MAX_FILES)
+
+
+def _header(scope, name):
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+class TrafficCaptureMiddleware:
+    # Plain ASGI middleware; requests outside CAPTURED_PATHS pass straight through
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in CAPTURED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        replay_token = current_replay_id.set(_header(scope, REPLAY_HEADER))
+        if not TRAFFIC_CAPTURE:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                current_replay_id.reset(replay_token)
+            return
+
+        record = {
+            "id": uuid.uuid4().hex,
+            "captured_at": datetime.utcnow().isoformat(),
+            "t": time.time(),
+            "method": scope["method"],
+            "path": scope["path"],
+            "query": scope.get("query_string", b"").decode("latin-1"),
+            "status": None,
+            "stages": {"sql_ms": 0.0, "sql_count": 0, "llm_ms": 0.0},
+            "llm_calls": [],
+        }
+        request_chunks = []
+        response_chunks = []
+
+        async def receive_and_keep():
+            message = await receive()
+            if message["type"] == "http.request":
+                request_chunks.append(message.get("body", b""))
+            return message
+
+        async def send_and_keep(message):
+            if message["type"] == "http.response.start":
+                record["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response_chunks.append(message.get("body", b""))
+            await send(message)
+
+        capture_token = current_capture.set(record)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive_and_keep, send_and_keep)
+        finally:
+            record["stages"]["total_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            current_capture.reset(capture_token)
+            current_replay_id.reset(replay_token)
+            try:
+                record["body"] = sanitize_body(json.loads(b"".join(request_chunks) or b"null"))
+            except ValueError:
+                record["body"] = None
+            try:
+                record["response"] = summarize_response(json.loads(b"".join(response_chunks) or b"null"))
+            except ValueError:
+                record["response"] = {}
+            try:
+                await asyncio.to_thread(writer.write, record)
+            except OSError as e:
+                print(f"Capture Error: {e}")
+
+
+def install_capture_sql_hooks(async_engine):
+    sync_engine = async_engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if current_capture.get() is not None and context is not None:
+            context._capture_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        record = current_capture.get()
+        if record is None or context is None or not hasattr(context, "_capture_started"):
+            return
+        record["stages"]["sql_ms"] += round((time.perf_counter() - context._capture_started) * 1000, 3)
+        record["stages"]["sql_count"] += 1
+
+
+def record_llm_exchange(provider, system_prompt, user_prompt, raw_response, latency, ok):
+    record = current_capture.get()
+    if record is None:
+        return
+    if ok:
+        record["stages"]["llm_ms"] = round(record["stages"]["llm_ms"] + latency * 1000, 3)
+    record["llm_calls"].append({
+        "provider": provider,
+        "prompt_hash": prompt_hash(system_prompt, user_prompt),
+        "latency_ms": round(latency * 1000, 3),
+        "ok": ok,
+        "raw_response": raw_response,
+    })
+
+
+# {capture id: [successful llm call, ...]} from capture files, for replay
+def load_captured_llm_calls(directory):
+    calls = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.jsonl"))):
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                ok_calls = [c for c in record.get("llm_calls", []) if c.get("ok")]
+                if ok_calls:
+                    calls[record["id"]] = ok_calls
+    return calls
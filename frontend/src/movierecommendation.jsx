@@ -3,6 +3,16 @@ import { useNavigate } from 'react-router-dom';
 import './movierecommendation.css';
 import MovieResults from './movieresults.jsx';
 
+// Per-tab token so the backend can skip movies this visitor was already shown
+const getSessionToken = () => {
+  let token = sessionStorage.getItem('movieFeelsSessionToken');
+  if (!token) {
+    token = crypto.randomUUID();
+    sessionStorage.setItem('movieFeelsSessionToken', token);
+  }
+  return token;
+};
+
 function MovieRecommendationPage() {
   const navigate = useNavigate();
 
@@ -49,6 +59,7 @@ function MovieRecommendationPage() {
         preference,
         personalNotes,
         timestamp: new Date().toISOString(),
+        sessionToken: getSessionToken(),
       };
       try {
         const response = await fetch('http://localhost:8000/movierecommendationuserinput', {